@@ -48,6 +48,10 @@ create table if not exists requests (
     references cos (id)  
 );
 
+-- requests are paged by time of arrival (then id, to page after a given row)
+
+create index if not exists requests_hreq_at_id on requests (hreq_at, id);
+
 -- =================================
 --     Attempts table definition    
 -- =================================
@@ -1,5 +1,6 @@
-from threading import Thread
-from time import sleep
+from asyncio import (run, sleep, gather, create_task, Semaphore,
+                     get_running_loop)
+from concurrent.futures import ThreadPoolExecutor
 
 from context import send_request
 
@@ -24,10 +25,16 @@ Send a request every INTERVAL seconds
 INTERVAL = 0.1  #  in seconds
 
 '''
-THREADS running in parallel
+THREADS dispatching requests in parallel
 '''
 THREADS = 1
 
+'''
+Stop dispatching when CONCURRENCY requests (all threads) are waiting for a 
+response
+'''
+CONCURRENCY = 64
+
 '''
 Stop when LIMIT requests (per thread) are sent (-1 is infinite)
 '''
@@ -43,24 +50,40 @@ DATA bytes to send
 '''
 DATA = b'data + program'
 
+# threads running the blocking send_request (one per request in flight)
+POOL = ThreadPoolExecutor(max_workers=CONCURRENCY)
 
-def _send_request(index: int, cos_id: int, data: bytes):
-    print('%d-' % index, send_request(cos_id=cos_id, data=data))
 
+async def _send_request(index: int, cos_id: int, data: bytes):
+    # send_request blocks until the response, so it runs in the pool
+    res = await get_running_loop().run_in_executor(
+        POOL, send_request, cos_id, data)
+    print('%d-' % index, res)
 
-def _send_requests():
+
+async def _send_requests(sem: Semaphore):
+    tasks = set()
     _limit = LIMIT
     index = 0
     while _limit != 0:
         _limit -= 1
         index += 1
         if SEQUENTIAL:
-            _send_request(index, COS_ID, DATA)
+            await _send_request(index, COS_ID, DATA)
         else:
-            Thread(target=_send_request, args=(
-                index, COS_ID, DATA)).start()
-        sleep(INTERVAL)
+            await sem.acquire()
+            task = create_task(_send_request(index, COS_ID, DATA))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+            task.add_done_callback(lambda _: sem.release())
+        await sleep(INTERVAL)
+    await gather(*tasks)
+
+
+async def _main():
+    sem = Semaphore(CONCURRENCY)
+    await gather(*(_send_requests(sem) for _ in range(THREADS)))
 
 
-for thread in range(THREADS):
-    Thread(target=_send_requests).start()
+run(_main())
+POOL.shutdown(wait=True)
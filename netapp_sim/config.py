@@ -1,24 +1,56 @@
 '''
     Loads conf.yml parameters as environment variables.
+
+    The parsed parameters are cached as JSON next to conf.yml, and reused 
+    until conf.yml is modified.
 '''
 
 
-from os import environ
-from os.path import dirname, abspath
-from yaml import safe_load
+from os import environ, replace, getpid
+from os.path import dirname, abspath, getmtime
+from json import load as json_load, loads as json_loads, dumps as json_dumps
+from yaml import load as yaml_load
+try:
+    # libyaml bindings, much faster than the pure Python loader
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
 
 
 ROOT_PATH = dirname(dirname(abspath(__file__)))
 CONF = ROOT_PATH + '/conf.yml'
+CONF_CACHE = CONF + '.cache.json'
 
 
-try:
+def _load():
+    try:
+        if getmtime(CONF_CACHE) > getmtime(CONF):
+            with open(CONF_CACHE, 'r') as f:
+                return json_load(f)
+    except (OSError, ValueError):
+        pass
     with open(CONF, 'r') as f:
-        config = safe_load(f)
-        for sect, params in config.items():
-            for param, value in params.items():
-                if value != None:
-                    environ[sect + '_' + param] = str(value)
+        config = yaml_load(f, Loader=SafeLoader)
+    try:
+        cache = json_dumps(config)
+        # only cache what JSON gives back unchanged (not dates, int keys...)
+        if json_loads(cache) == config:
+            # written aside then renamed, so the cache is never truncated
+            tmp = CONF_CACHE + '.' + str(getpid())
+            with open(tmp, 'w') as f:
+                f.write(cache)
+            replace(tmp, CONF_CACHE)
+    except (OSError, TypeError, ValueError):
+        pass
+    return config
+
+
+try:
+    config = _load()
+    for sect, params in config.items():
+        for param, value in params.items():
+            if value != None:
+                environ[sect + '_' + param] = str(value)
 
 except Exception as e:
     print(' *** ERROR in config:', e.__class__.__name__, e)
@@ -7,26 +7,63 @@
     --------
     insert(obj): Insert obj as a row in its corresponding database table. 
 
+    insert_many(cls, objs): Insert objs as rows in the database table of cls.
+
+    insert_all(objs): Insert objs (of any classes) as rows in their 
+    corresponding database tables.
+
     update(obj): Update corresponding database table row from obj.
     
     select(cls, fields, as_obj): Select row(s) from the database table of cls.
 
     as_csv(cls): Convert the database table of cls to a CSV file.
+
+    transaction(): Context manager running the writes of its block in a 
+    single transaction (all or none).
+
+    invalidate_cos_cache(): Forget the CoS rows cached when decoding requests 
+    (done automatically when CoS are inserted or updated through this module).
+
+    insert_async(obj), update_async(obj), select_async(cls, fields, as_obj): 
+    Awaitable versions of insert, update and select, for use in asyncio 
+    event loops.
 '''
 
 
 from os import getenv
 from os.path import dirname, abspath
-from queue import Queue
-from threading import Thread, Event
-from sqlite3 import connect
+from sys import stdout
+from queue import Queue, SimpleQueue, Empty, Full
+from threading import Thread, Lock, local
+from concurrent.futures import Future, TimeoutError
+from asyncio import wrap_future
+from sqlite3 import connect, sqlite_version_info, Error
 from csv import writer
-
-from model import Model, CoS, Request, Attempt, Response
+from itertools import chain, starmap
+from zlib import crc32
+from functools import lru_cache
+from operator import attrgetter
+from contextlib import contextmanager
+from logging import getLogger, StreamHandler
+from logging.handlers import QueueHandler, QueueListener
+from atexit import register
+
+from model import Model, CoSSpecs, CoS, Request, Attempt, Response
 from consts import MY_IP
 import config
 
 
+# errors are logged through a queue and written out by a listener thread, so
+# that threads reporting them never wait for the output
+_logger = getLogger(__name__)
+_logger.propagate = False
+_log_queue = SimpleQueue()
+_logger.addHandler(QueueHandler(_log_queue))
+_log_listener = QueueListener(_log_queue, StreamHandler(stdout))
+_log_listener.start()
+register(_log_listener.stop)
+
+
 # database config
 ROOT_PATH = dirname(dirname(abspath(__file__)))
 
@@ -52,23 +89,128 @@ if _db_defs_path == None:
     _db_defs_path = ''
 DB_DEFS_PATH = ROOT_PATH + '/' + _db_defs_path
 
-# table definitions
-try:
-    DEFINITIONS = open(DB_DEFS_PATH, 'r').read()
-except:
-    DEFINITIONS = ''
-
 # table names
 _tables = {
-    CoS.__name__: 'cos',
-    Request.__name__: 'requests',
-    Attempt.__name__: 'attempts',
-    Response.__name__: 'responses'
+    CoS: 'cos',
+    Request: 'requests',
+    Attempt: 'attempts',
+    Response: 'responses'
 }
 
-# queue managing db operations from multiple threads
-_queue = Queue()
-_rows = {}
+# table columns
+_columns = {
+    CoS: ('id', 'name', 'max_response_time', 'min_concurrent_users',
+          'min_requests_per_second', 'min_bandwidth', 'max_delay',
+          'max_jitter', 'max_loss_rate', 'min_cpu', 'min_ram', 'min_disk'),
+    Request: ('id', 'cos_id', 'data', 'result', 'host', 'state', 'hreq_at',
+              'dres_at'),
+    Attempt: ('req_id', 'attempt_no', 'host', 'state', 'hreq_at', 'hres_at',
+              'rres_at', 'dres_at'),
+    Response: ('req_id', 'attempt_no', 'host', 'cpu', 'ram', 'disk',
+               'timestamp')
+}
+
+# columns that objects can't do without (their keys, the CoS of requests,
+# and the timestamp of responses, which they would set to the current time
+# if read as null), always selected when objects are built from a subset of
+# fields
+_key_columns = {
+    CoS: ('id', 'name'),
+    Request: ('id', 'cos_id'),
+    Attempt: ('req_id', 'attempt_no'),
+    Response: ('req_id', 'attempt_no', 'host', 'timestamp')
+}
+
+# default values of CoS specs (in the order of their columns)
+_specs_defaults = CoSSpecs.__init__.__defaults__
+
+# objects encoded as table rows (attributes in the order of their columns,
+# read at once by attrgetter)
+_adapters = {
+    CoS: attrgetter('id', 'name', *('specs.' + col
+                                    for col in _columns[CoS][2:])),
+    Request: attrgetter('id', 'cos.id', *_columns[Request][2:]),
+    Attempt: attrgetter(*_columns[Attempt]),
+    Response: attrgetter(*_columns[Response])
+}
+
+# table rows decoded as lists of objects (requests are decoded by _convert,
+# since their rows come with the rows of their attempts and CoS), rows that
+# match the constructor's arguments are passed to it by starmap's C loop
+_converters = {
+    # specs missing (null) from the row keep their defaults
+    CoS: lambda rows: [CoS(item[0], item[1], CoSSpecs(*[
+        default if val is None else val
+        for val, default in zip(item[2:], _specs_defaults)]))
+        for item in rows],
+    Attempt: lambda rows: list(starmap(Attempt, rows)),
+    Response: lambda rows: list(starmap(Response, rows))
+}
+
+# single row placeholders, e.g. (?,?,?)
+_placeholders = {cls: '(' + ','.join('?' * len(cols)) + ')'
+                 for cls, cols in _columns.items()}
+
+# insert statements
+_insert_sql = {cls: 'insert into {} {} values {}'.format(
+                   _tables[cls], str(cols), _placeholders[cls])
+               for cls, cols in _columns.items()}
+
+# update statements (where clause to be formatted in)
+_update_sql = {cls: 'update {} set {} {{}}'.format(
+                   _tables[cls], ','.join(col + '=?' for col in cols))
+               for cls, cols in _columns.items()}
+
+# number of writes submitted to _execute and of those it committed
+_writes = {'submitted': 0, 'committed': 0}
+_writes_lock = Lock()
+
+# writes made in transaction blocks (by thread), submitted together as a
+# single _TRANSACTION operation
+_transactions = local()
+_TRANSACTION = 'transaction'
+
+# queue managing db operations from multiple threads (bounded, so callers
+# block on put once _QUEUE_SIZE operations are waiting, until the worker
+# catches up)
+_QUEUE_SIZE = 10000
+_queue = Queue(maxsize=_QUEUE_SIZE)
+
+# writes are coalesced in a single transaction, committed after
+# _TXN_MAX_WRITES writes or when no write arrives for _TXN_WINDOW seconds
+_TXN_MAX_WRITES = 500
+_TXN_WINDOW = 0.005  # in seconds
+
+# max number of host parameters in a single statement
+_MAX_VARIABLES = 32766 if sqlite_version_info >= (3, 32, 0) else 999
+
+# multi-row inserts pack _batch_rows rows (at most _INSERT_BATCH_ROWS, within
+# the host parameters limit), remaining rows use the single-row statement
+_INSERT_BATCH_ROWS = 256
+_batch_rows = {cls: min(_INSERT_BATCH_ROWS, _MAX_VARIABLES // len(cols))
+               for cls, cols in _columns.items()}
+_insert_batch_sql = {cls: 'insert into {} {} values {}'.format(
+                         _tables[cls], str(cols),
+                         ','.join([_placeholders[cls]] * _batch_rows[cls]))
+                     for cls, cols in _columns.items()}
+
+# number of prepared statements kept by the connection (keyed by sql text)
+_CACHED_STATEMENTS = 256
+
+# CSV export reads rows by chunks and writes them through a large buffer
+_CSV_CHUNK_SIZE = 10000  # in rows
+_CSV_BUFFER_SIZE = 1 << 20  # in bytes
+
+# time to wait (in s) for the worker to take, then to commit, pending writes
+# when the process exits, after which they are abandoned (so a stuck worker,
+# e.g. on a database locked by another process, doesn't hang the exit)
+_FLUSH_TIMEOUT = 5
+
+# CoS rows (by id) cached when decoding requests, and version of the cache
+# (incremented when CoS are written, so that rows read before are not cached)
+_cos_rows = {}
+_cos_version = 0
+_cos_lock = Lock()
 
 
 # ====================
@@ -84,30 +226,73 @@ def insert(obj: Model):
     '''
 
     try:
-        cols = _get_columns(obj.__class__)
-        _len = len(cols)
-        vals = '('
-        for i in range(_len):
-            vals += '?'
-            if i < _len - 1:
-                vals += ','
-        vals += ')'
-
-        event = Event()
-
-        global _queue
-        _queue.put((
-            'insert into {} {} values {}'.format(
-                _tables[obj.__class__.__name__], str(cols), vals),
-            _adapt(obj),
-            event
-        ))
-
-        event.wait()
+        _insert(obj).result()
         return True
 
-    except Exception as e:
-        print(' *** ERROR in dblib.insert', e.__class__.__name__, e)
+    except Error as e:
+        _logger.error(' *** ERROR in dblib.insert %s %s',
+                      e.__class__.__name__, e)
+        return False
+
+
+async def insert_async(obj: Model):
+    '''
+        Awaitable version of insert.
+
+        Returns True if inserted, False if not.
+    '''
+
+    try:
+        await wrap_future(_insert(obj))
+        return True
+
+    except Error as e:
+        _logger.error(' *** ERROR in dblib.insert_async %s %s',
+                      e.__class__.__name__, e)
+        return False
+
+
+def insert_many(cls, objs: list):
+    '''
+        Insert objs (instances of cls) as rows in the database table of cls, 
+        packing as many rows as possible in each statement.
+
+        Returns True if inserted, False if not.
+    '''
+
+    try:
+        for future in _insert_many(cls, list(objs)):
+            future.result()
+        return True
+
+    except Error as e:
+        _logger.error(' *** ERROR in dblib.insert_many %s %s',
+                      e.__class__.__name__, e)
+        return False
+
+
+def insert_all(objs: list):
+    '''
+        Insert objs (instances of any model classes) as rows in their 
+        corresponding database tables, grouping them by class and waiting 
+        once for all of them.
+
+        Returns True if inserted, False if not.
+    '''
+
+    try:
+        groups = {}
+        for obj in objs:
+            groups.setdefault(obj.__class__, []).append(obj)
+        futures = [future for cls, group in groups.items()
+                   for future in _insert_many(cls, group)]
+        for future in futures:
+            future.result()
+        return True
+
+    except Error as e:
+        _logger.error(' *** ERROR in dblib.insert_all %s %s',
+                      e.__class__.__name__, e)
         return False
 
 
@@ -119,29 +304,29 @@ def update(obj: Model, _id: tuple = ('id',)):
     '''
 
     try:
-        _id_dict = {_id_field: ('=', getattr(obj, _id_field))
-                    for _id_field in _id}
-        where, vals = _get_where_str(**_id_dict)
-        cols = _get_columns(obj.__class__)
-        sets = ''
-        for col in cols:
-            sets += col + '=?,'
-
-        event = Event()
-
-        global _queue
-        _queue.put((
-            'update {} set {} {}'.format(
-                _tables[obj.__class__.__name__], sets[:-1], where),
-            _adapt(obj) + vals,
-            event
-        ))
-
-        event.wait()
+        _update(obj, _id).result()
+        return True
+
+    except Error as e:
+        _logger.error(' *** ERROR in dblib.update %s %s',
+                      e.__class__.__name__, e)
+        return False
+
+
+async def update_async(obj: Model, _id: tuple = ('id',)):
+    '''
+        Awaitable version of update.
+
+        Returns True if updated, False if not.
+    '''
+
+    try:
+        await wrap_future(_update(obj, _id))
         return True
 
-    except Exception as e:
-        print(' *** ERROR in dblib.update', e.__class__.__name__, e)
+    except Error as e:
+        _logger.error(' *** ERROR in dblib.update_async %s %s',
+                      e.__class__.__name__, e)
         return False
 
 
@@ -154,74 +339,70 @@ def select(cls, fields: tuple = ('*',), groups: tuple = None,
 
             >>> select(CoS, fields=('id', 'name'), id=('=', 1), as_obj=False)
 
-        as_obj should only be set to True if fields is (*).
+        The 'in' condition takes a sequence of values, e.g. id=('in', (1, 2)).
+
+        If as_obj is True, fields must be columns of the table (or (*)), the 
+        key columns (and the CoS of requests, the timestamp of responses) 
+        are always read, the other columns are not read and left to None (or 
+        their defaults).
 
         Returns list of rows if selected, None if not.
     '''
 
     try:
-        where, vals = _get_where_str(**kwargs)
-        group_by = _get_groups_str(groups)
-
-        event = Event()
+        return _fetch(cls, *_select_sql(
+            cls, _get_obj_fields(cls, fields) if as_obj else fields, groups,
+            **kwargs),
+                      as_obj)
+
+    except Error as e:
+        _logger.error(' *** ERROR in dblib.select %s %s',
+                      e.__class__.__name__, e)
+        return None
 
-        global _queue
-        _queue.put((
-            'select {} from {} {}'.format(
-                _get_fields_str(fields), _tables[cls.__name__],
-                where + group_by),
-            vals,
-            event
-        ))
 
-        event.wait()
+async def select_async(cls, fields: tuple = ('*',), groups: tuple = None,
+                       as_obj: bool = True, **kwargs):
+    '''
+        Awaitable version of select.
 
-        global _rows
-        if as_obj:
-            return _convert(_rows[event], cls)
-        return _rows[event]
+        Returns list of rows if selected, None if not.
+    '''
 
-    except Exception as e:
-        print(' *** ERROR in dblib.select', e.__class__.__name__, e)
+    try:
+        return await _fetch_async(
+            cls, *_select_sql(
+                cls, _get_obj_fields(cls, fields) if as_obj else fields,
+                groups, **kwargs), as_obj)
+
+    except Error as e:
+        _logger.error(' *** ERROR in dblib.select_async %s %s',
+                      e.__class__.__name__, e)
         return None
 
 
 def select_page(cls, page: int, page_size: int, fields: tuple = ('*',),
-                orders: tuple = None, as_obj: bool = True, **kwargs):
+                orders: tuple = None, as_obj: bool = True,
+                after: tuple = None, **kwargs):
     '''
         ...
     '''
 
+    # if after (values of orders in the last row of the previous page) is
+    # given, the page starts right after it instead of skipping the rows of
+    # all previous pages (orders must then be ascending and unique together)
     try:
-        where, vals = _get_where_str(**kwargs)
-        order_by = _get_orders_str(orders)
-        if not where:
-            where += ' where '
-        else:
-            where += ' and '
-        where += ' oid not in (select oid from {} {} limit {}) '.format(
-            _tables[cls.__name__], order_by, (page - 1) * page_size)
-
-        event = Event()
-
-        global _queue
-        _queue.put((
-            'select {} from {} {} limit {}'.format(
-                _get_fields_str(fields), _tables[cls.__name__],
-                where + order_by, page_size),
-            vals,
-            event
-        ))
-
-        event.wait()
-
-        global _rows
         if as_obj:
-            return _convert(_rows[event], cls)
-        return _rows[event]
-
-    except Exception as e:
-        print(' *** ERROR in dblib.select_page', e.__class__.__name__, e)
+            fields = _get_obj_fields(cls, fields)
+        return _fetch(cls, _page_sql(cls, tuple(fields), tuple(orders or ()),
+                                     _get_conds(**kwargs), bool(after)),
+                      _get_vals(**kwargs) + (
+                          tuple(after) + (page_size, 0) if after else
+                          (page_size, (page - 1) * page_size)), as_obj)
+
+    except Error as e:
+        _logger.error(' *** ERROR in dblib.select_page %s %s',
+                      e.__class__.__name__, e)
         return None
 
 
@@ -237,188 +418,496 @@ def as_csv(cls, fields: tuple = ('*',), abs_path: str = '', _suffix: str = '',
         Returns True if converted, False if not.
     '''
 
-    rows = select(cls, fields, as_obj=False, **kwargs)
-    if rows != None:
-        try:
-            if fields[0] == '*':
-                fields = _get_columns(cls)
-            with open(abs_path if abs_path else (
-                    ROOT_PATH + '/data/' + _tables[cls.__name__] + _suffix + '.csv'),
-                    'w', newline='') as file:
-                csv_writer = writer(file)
-                csv_writer.writerow(fields)
+    # in-memory database is only reachable from _execute, otherwise rows are
+    # streamed from the calling thread's connection once pending writes are
+    # committed
+    try:
+        sql, vals = _select_sql(cls, fields, **kwargs)
+        if DB_PATH == ':memory:':
+            chunks = [_submit(sql, vals).result()]
+        else:
+            if not _synced():
+                _submit('select 1', ()).result()  # _execute commits first
+            cursor = Connection().execute(sql, vals)
+            chunks = iter(lambda: cursor.fetchmany(_CSV_CHUNK_SIZE), [])
+        if fields[0] == '*':
+            fields = _columns[cls]
+        with open(abs_path if abs_path else (
+                ROOT_PATH + '/data/' + _tables[cls] + _suffix + '.csv'),
+                'w', newline='', buffering=_CSV_BUFFER_SIZE) as file:
+            csv_writer = writer(file)
+            csv_writer.writerow(fields)
+            for rows in chunks:
                 csv_writer.writerows(rows)
-            return True
+        return True
 
-        except Exception as e:
-            print(' *** ERROR in dblib.as_csv', e.__class__.__name__, e)
-            return False
-    else:
+    except (Error, OSError) as e:
+        _logger.error(' *** ERROR in dblib.as_csv %s %s',
+                      e.__class__.__name__, e)
         return False
 
 
+@contextmanager
+def transaction():
+    '''
+        Context manager grouping the writes (insert, insert_many, insert_all, 
+        update and their async versions) made by the calling thread in its 
+        block, so that they are run together, all or none, when it exits. 
+        Nested blocks join the outermost one.
+
+        Writes in the block report success as soon as they are grouped, so 
+        errors are raised when the block exits (writes are discarded if the 
+        block raises).
+    '''
+
+    if getattr(_transactions, 'ops', None) is not None:
+        yield
+        return
+    _transactions.ops = []
+    _transactions.cos = False
+    try:
+        yield
+        ops = _transactions.ops
+        cos = _transactions.cos
+    finally:
+        _transactions.ops = None
+    if ops:
+        _watch(CoS if cos else None, _submit(_TRANSACTION, ops)).result()
+
+
+def invalidate_cos_cache():
+    '''
+        Forget the CoS rows cached when decoding requests (to be called if CoS 
+        are written without using this module).
+    '''
+
+    global _cos_version
+    with _cos_lock:
+        _cos_version += 1
+        _cos_rows.clear()
+
+
 # =============
 #     UTILS
 # =============
 
 
-# singleton database connection
+# queue sql statement for _execute, returns Future of its result
+def _submit(sql: str, params: tuple):
+    future = Future()
+    ops = getattr(_transactions, 'ops', None)
+    if ops is not None and sql[0:6] != 'select':
+        ops.append((sql, params))
+        future.set_result(True)
+        return future
+    if sql[0:6] != 'select':
+        with _writes_lock:
+            _writes['submitted'] += 1
+    global _queue
+    _queue.put((sql, params, future))
+    return future
+
+
+def _insert(obj: Model):
+    return _watch(obj.__class__,
+                  _submit(_insert_sql[obj.__class__], _adapt(obj)))
+
+
+# submit objs (instances of cls) by batches of _batch_rows rows, and the
+# remaining ones row by row (they are run together by _execute anyway), so
+# only two statements are ever prepared per table
+def _insert_many(cls, objs: list):
+    size = _batch_rows[cls]
+    tail = len(objs) - len(objs) % size
+    return [_watch(cls, future) for future in (
+        [_submit(_insert_batch_sql[cls],
+                 tuple(chain.from_iterable(map(_adapt, objs[i:i + size]))))
+         for i in range(0, tail, size)] +
+        [_submit(_insert_sql[cls], _adapt(obj)) for obj in objs[tail:]])]
+
+
+def _update(obj: Model, _id: tuple = ('id',)):
+    return _watch(obj.__class__,
+                  _submit(_update_by_sql(obj.__class__, _id),
+                          _adapt(obj) + tuple(getattr(obj, _id_field)
+                                              for _id_field in _id)))
+
+
+# invalidate cached CoS rows once a CoS write is done
+def _watch(cls, future: Future):
+    if cls is CoS:
+        if getattr(_transactions, 'ops', None) is not None:
+            _transactions.cos = True  # invalidate when transaction is done
+        future.add_done_callback(lambda _: invalidate_cos_cache())
+    return future
+
+
+# update statement, built once per id fields so consecutive updates share the
+# same sql (and can be batched by _execute)
+@lru_cache(maxsize=_CACHED_STATEMENTS)
+def _update_by_sql(cls, _id: tuple):
+    return _update_sql[cls].format(
+        _get_where_str(*((_id_field, '=?') for _id_field in _id)))
+
+
+def _select_sql(cls, fields: tuple = ('*',), groups: tuple = None,
+                **kwargs):
+    return (_select_by_sql(cls, tuple(fields), tuple(groups or ()),
+                           _get_conds(**kwargs)),
+            _get_vals(**kwargs))
+
+
+# select statement, built once per fields, groups and where conditions
+@lru_cache(maxsize=_CACHED_STATEMENTS)
+def _select_by_sql(cls, fields: tuple, groups: tuple, conds: tuple):
+    return 'select {} from {} {}'.format(
+        _get_fields_str(fields), _tables[cls],
+        _get_where_str(*conds) + _get_groups_str(groups))
+
+
+# page select statement, built once per fields, orders and where conditions
+# (the values to start after if any, then size and offset of the page, are
+# bound after the where values)
+@lru_cache(maxsize=_CACHED_STATEMENTS)
+def _page_sql(cls, fields: tuple, orders: tuple, conds: tuple,
+              after: bool = False):
+    if after:
+        conds += (('({})'.format(','.join(orders)),
+                   '>({})'.format(','.join('?' * len(orders)))),)
+    return 'select {} from {} {} limit ? offset ?'.format(
+        _get_fields_str(fields), _tables[cls],
+        _get_where_str(*conds) + _get_orders_str(orders))
+
+
+# run select sql, returns rows (as objects of cls if as_obj)
+def _fetch(cls, sql: str, vals: tuple, as_obj: bool = True):
+    if not as_obj:
+        return _read(sql, vals)
+    # requests are fetched with their CoS and attempts in three queries
+    # instead of two more queries per request
+    if cls is Request:
+        rows = _read(sql, vals)
+        cos, version, missing, attempts = _related(rows)
+        return _convert(rows, cls,
+                        [row for in_sql in attempts
+                         for row in _read(*in_sql)],
+                        _cache_cos(cos, version, [
+                            row for in_sql in missing
+                            for row in _read(*in_sql)]))
+    return _convert(_read(sql, vals), cls)
+
+
+async def _fetch_async(cls, sql: str, vals: tuple, as_obj: bool = True):
+    if not as_obj:
+        return await wrap_future(_submit(sql, vals))
+    if cls is Request:
+        rows = await wrap_future(_submit(sql, vals))
+        cos, version, missing, attempts = _related(rows)
+        missing = [_submit(*in_sql) for in_sql in missing]
+        attempts = [_submit(*in_sql) for in_sql in attempts]
+        return _convert(rows, cls,
+                        [row for future in attempts
+                         for row in await wrap_future(future)],
+                        _cache_cos(cos, version, [
+                            row for future in missing
+                            for row in await wrap_future(future)]))
+    return _convert(await wrap_future(_submit(sql, vals)), cls)
+
+
+# get the cached CoS rows of requests rows (with the cache version), and
+# selects of their missing CoS rows and of their attempts
+def _related(rows: list):
+    cos = {}
+    missing = set()
+    with _cos_lock:
+        version = _cos_version
+        for row in rows:
+            if row[1] in _cos_rows:
+                cos[row[1]] = _cos_rows[row[1]]
+            else:
+                missing.add(row[1])
+    return (cos, version,
+            _in_sql('cos', 'id', missing),
+            _in_sql('attempts', 'req_id', [row[0] for row in rows]))
+
+
+# add selected CoS rows to cached ones, and to the cache unless CoS were
+# written since version
+def _cache_cos(cos: dict, version: int, rows: list):
+    for row in rows:
+        cos[row[0]] = tuple(row)
+    with _cos_lock:
+        if version == _cos_version:
+            _cos_rows.update(cos)
+    return list(cos.values())
+
+
+# select rows of table where field is in ids (as many queries as parameter
+# limit needs)
+def _in_sql(table: str, field: str, ids):
+    ids = tuple(ids)
+    return [('select * from {} where {} in ({})'.format(
+                table, field, ','.join('?' * len(ids[i:i + _MAX_VARIABLES]))),
+             ids[i:i + _MAX_VARIABLES])
+            for i in range(0, len(ids), _MAX_VARIABLES)]
+
+
+# check if all writes submitted to _execute are committed
+def _synced():
+    with _writes_lock:
+        return _writes['submitted'] == _writes['committed']
+
+
+# run select in the calling thread if all submitted writes are committed
+# (so it sees them), else through _execute (in-memory database is only
+# reachable from _execute)
+def _read(sql: str, vals: tuple):
+    if DB_PATH != ':memory:' and _synced():
+        return Connection().execute(sql, vals).fetchall()
+    return _submit(sql, vals).result()
+
+
+# set up the database: WAL (kept in the database file) lets readers run
+# alongside the writer and makes each commit a single append to the log, and
+# definitions are only run if they changed since the last run (their
+# checksum is kept as the database's user_version)
+def _initialize(connection):
+    if DB_PATH != ':memory:':
+        connection.execute('pragma journal_mode=WAL')
+    try:
+        with open(DB_DEFS_PATH, 'r') as file:
+            definitions = file.read()
+    except OSError:
+        definitions = ''
+    version = crc32(definitions.encode()) & 0x7fffffff
+    if connection.execute('pragma user_version').fetchone()[0] != version:
+        connection.executescript(definitions)
+        connection.execute('pragma user_version=%d' % version)
+
+
+# database connection of the calling thread (the one of _execute is the only
+# writer, others only read, which WAL allows alongside the writer)
 class Connection:
+    _local = local()
+    _lock = Lock()
+    _initialized = False
+
     def __new__(self):
-        if not hasattr(self, '_connection'):
-            self._connection = connect(DB_PATH)
-            self._connection.executescript(DEFINITIONS).connection.commit()
-            self._connection.row_factory = lambda _, row: list(row)
-        return self._connection
+        connection = getattr(self._local, 'connection', None)
+        if not connection:
+            # transactions are managed explicitly by _execute
+            connection = connect(DB_PATH, isolation_level=None,
+                                 cached_statements=_CACHED_STATEMENTS)
+            if DB_PATH != ':memory:':
+                connection.executescript(
+                    'pragma synchronous=NORMAL;'
+                    'pragma temp_store=MEMORY;'
+                    'pragma cache_size=-20000;'  # in KB
+                    'pragma mmap_size=268435456;')  # in bytes
+            # the database is set up by the first connection only
+            if not self._initialized:
+                with self._lock:
+                    if not self._initialized:
+                        _initialize(connection)
+                        self._initialized = True
+            connection.row_factory = lambda _, row: list(row)
+            self._local.connection = connection
+        return connection
 
 
 def _execute():
     global _queue
-    global _rows
+    in_txn = False
+    writes_since_commit = 0
+    pending = None
     while True:
+        futures = ()
         try:
-            sql, params, event = _queue.get()
-            cursor = Connection().execute(sql, params)
+            if pending:
+                (sql, params, future), pending = pending, None
+            else:
+                try:
+                    sql, params, future = _queue.get(
+                        timeout=_TXN_WINDOW if in_txn else None)
+                except Empty:
+                    # no more writes for now, commit pending ones
+                    _commit(writes_since_commit)
+                    in_txn = False
+                    writes_since_commit = 0
+                    continue
+            futures = (future,)
             if sql[0:6] == 'select':
-                _rows[event] = cursor.fetchall()
-            event.set()
-            if sql[0:6] != 'select' and _queue.empty():
-                cursor.connection.commit()
+                if in_txn:
+                    # flush pending writes before reading
+                    _commit(writes_since_commit)
+                    in_txn = False
+                    writes_since_commit = 0
+                future.set_result(Connection().execute(sql, params).fetchall())
+                continue
+            if not in_txn:
+                Connection().execute('begin')
+                in_txn = True
+            # consecutive writes of the same statement are run together
+            batch = [(params, future)]
+            while writes_since_commit + len(batch) < _TXN_MAX_WRITES:
+                try:
+                    entry = _queue.get_nowait()
+                except Empty:
+                    break
+                if entry[0] != sql:
+                    pending = entry
+                    break
+                batch.append(entry[1:])
+            futures = [future for _, future in batch]
+            writes_since_commit += len(batch)
+            _write(sql, batch)
+            if writes_since_commit >= _TXN_MAX_WRITES:
+                _commit(writes_since_commit)
+                in_txn = False
+                writes_since_commit = 0
 
         except Exception as e:
-            print(' *** ERROR in dblib._execute', e.__class__.__name__, e)
+            # don't leave the callers waiting (they log the error), it is
+            # only logged here if no caller is left to get it
+            notified = False
+            for future in futures:
+                if not future.done():
+                    future.set_exception(e)
+                    notified = True
+            if not notified:
+                _logger.error(' *** ERROR in dblib._execute %s %s',
+                              e.__class__.__name__, e)
+
+
+# commit the writes run by _execute since the last commit
+def _commit(writes: int):
+    Connection().commit()
+    with _writes_lock:
+        _writes['committed'] += writes
+
+
+# run writes of the same statement with a single executemany, or one by one
+# if it fails so that each error is reported to its own caller
+def _write(sql: str, batch: list):
+    conn = Connection()
+    # each transaction runs in its own savepoint (rolled back if any of its
+    # operations fails)
+    if sql is _TRANSACTION:
+        for ops, future in batch:
+            conn.execute('savepoint txn')
+            try:
+                for op in ops:
+                    conn.execute(*op)
+                conn.execute('release txn')
+                future.set_result(True)
+            except Exception as e:
+                conn.execute('rollback to txn')
+                conn.execute('release txn')
+                future.set_exception(e)
+        return
+    if len(batch) > 1:
+        conn.execute('savepoint batch')
+        try:
+            conn.executemany(sql, [params for params, _ in batch])
+            conn.execute('release batch')
+            for _, future in batch:
+                future.set_result(True)
+            return
+        except Exception:
+            conn.execute('rollback to batch')
+            conn.execute('release batch')
+    for params, future in batch:
+        try:
+            conn.execute(sql, params)
+            future.set_result(True)
+        except Exception as e:
+            future.set_exception(e)
+
+
+# commit pending writes before the process exits (the worker is a daemon
+# thread, so it doesn't keep the process alive on its own)
+def _flush():
+    future = Future()
+    try:
+        _queue.put(('select 1', (), future), timeout=_FLUSH_TIMEOUT)
+        future.result(timeout=_FLUSH_TIMEOUT)  # _execute commits first
+    except (Full, TimeoutError):
+        _logger.error(' *** ERROR in dblib._flush worker not done after %ss, '
+                      'pending writes abandoned', _FLUSH_TIMEOUT)
+    except Error as e:
+        _logger.error(' *** ERROR in dblib._flush %s %s',
+                      e.__class__.__name__, e)
 
 
-Thread(target=_execute).start()
+Thread(target=_execute, daemon=True).start()
+register(_flush)
 
 
 # encode object as table row
 def _adapt(obj: Model):
-    if obj.__class__.__name__ is CoS.__name__:
-        return (obj.id, obj.name, obj.get_max_response_time(),
-                obj.get_min_concurrent_users(),
-                obj.get_min_requests_per_second(), obj.get_min_bandwidth(),
-                obj.get_max_delay(), obj.get_max_jitter(),
-                obj.get_max_loss_rate(), obj.get_min_cpu(), obj.get_min_ram(),
-                obj.get_min_disk(),)
-
-    if obj.__class__.__name__ is Request.__name__:
-        return (obj.id, obj.cos.id, obj.data, obj.result, obj.host, obj.state,
-                obj.hreq_at, obj.dres_at)
-
-    if obj.__class__.__name__ is Attempt.__name__:
-        return (obj.req_id, obj.attempt_no, obj.host, obj.state, obj.hreq_at,
-                obj.hres_at, obj.rres_at, obj.dres_at)
-
-    if obj.__class__.__name__ is Response.__name__:
-        return (obj.req_id, obj.attempt_no, obj.host, obj.cpu, obj.ram,
-                obj.disk, obj.timestamp)
-
-
-# decode table rows as objects
-def _convert(itr: list, cls):
-    ret = []
-    for item in itr:
-        if cls.__name__ is CoS.__name__:
-            obj = CoS(item[0], item[1])
-            if item[2] != None:
-                obj.set_max_response_time(item[2])
-            if item[3] != None:
-                obj.set_min_concurrent_users(item[3])
-            if item[4] != None:
-                obj.set_min_requests_per_second(item[4])
-            if item[5] != None:
-                obj.set_min_bandwidth(item[5])
-            if item[6] != None:
-                obj.set_max_delay(item[6])
-            if item[7] != None:
-                obj.set_max_jitter(item[7])
-            if item[8] != None:
-                obj.set_max_loss_rate(item[8])
-            if item[9] != None:
-                obj.set_min_cpu(item[9])
-            if item[10] != None:
-                obj.set_min_ram(item[10])
-            if item[11] != None:
-                obj.set_min_disk(item[11])
-
-        if cls.__name__ is Request.__name__:
-            obj = Request(
-                item[0], select(CoS, id=('=', item[1]))[0], item[2], item[3],
-                item[4], item[5], item[6], item[7], {
-                    att.attempt_no: att
-                    for att in select(Attempt, req_id=('=', item[0]))
-                })
-
-        if cls.__name__ is Attempt.__name__:
-            obj = Attempt(item[0], item[1], item[2], item[3], item[4], item[5],
-                          item[6], item[7])
-
-        if cls.__name__ is Response.__name__:
-            obj = Response(item[0], item[1], item[2], item[3], item[4],
-                           item[5], item[6])
-
-        ret.append(obj)
-    return ret
+    return _adapters[obj.__class__](obj)
+
+
+# decode table rows as objects (requests rows come with the rows of their
+# attempts and CoS, each CoS object being shared by its requests)
+def _convert(itr: list, cls, attempts: list = (), cos: list = ()):
+    if cls is Request:
+        _cos = {obj.id: obj for obj in _convert(cos, CoS)}
+        _attempts = {}
+        for attempt in _convert(attempts, Attempt):
+            _attempts.setdefault(attempt.req_id, {})[
+                attempt.attempt_no] = attempt
+        return [Request(item[0], _cos.get(item[1]), item[2], item[3],
+                        item[4], item[5], item[6], item[7],
+                        _attempts.get(item[0]))
+                for item in itr]
+    return _converters[cls](itr)
 
 
 # get table columns as tuple
 def _get_columns(cls):
-    if cls.__name__ is CoS.__name__:
-        return ('id', 'name', 'max_response_time', 'min_concurrent_users',
-                'min_requests_per_second', 'min_bandwidth', 'max_delay',
-                'max_jitter', 'max_loss_rate', 'min_cpu', 'min_ram',
-                'min_disk')
+    return _columns.get(cls, ())
 
-    if cls.__name__ is Request.__name__:
-        return ('id', 'cos_id', 'data', 'result', 'host', 'state', 'hreq_at',
-                'dres_at')
 
-    if cls.__name__ is Attempt.__name__:
-        return ('req_id', 'attempt_no', 'host', 'state', 'hreq_at', 'hres_at',
-                'rres_at', 'dres_at')
+# fields to select to build objects of cls, in the order of its columns,
+# with its key columns added (the other ones not requested are selected as
+# null, so they are not read), fields that are not columns are left as is
+# (to fail as such)
+def _get_obj_fields(cls, fields: tuple):
+    if fields[0] == '*' or not set(fields) <= set(_columns[cls]):
+        return fields
+    fields = set(fields).union(_key_columns[cls])
+    return tuple(col if col in fields else 'null' for col in _columns[cls])
 
-    if cls.__name__ is Response.__name__:
-        return ('req_id', 'attempt_no', 'host', 'cpu', 'ram', 'disk',
-                'timestamp')
 
-    return ()
+def _get_fields_str(fields: tuple):
+    return ','.join(fields)
 
 
-def _get_fields_str(fields: tuple):
-    fields_str = '*'
-    for field in fields:
-        fields_str += field + ','
-    if fields_str != '*':
-        fields_str = fields_str[1:-1]
-    return fields_str
+# where conditions of kwargs, e.g. (('id', '=?'), ('state', ' in (?,?)'))
+def _get_conds(**kwargs):
+    return tuple((key, ' in ({})'.format(','.join('?' * len(val)))
+                  if cond == 'in' else cond + '?')
+                 for key, (cond, val) in kwargs.items())
 
 
-def _get_where_str(**kwargs):
-    where = ''
+# values of kwargs, bound in the order of their conditions
+def _get_vals(**kwargs):
     vals = ()
-    for key in kwargs:
-        cond, val = kwargs[key]
-        where += key + cond + '? and '
-        vals += (str(val),)
-    if where:
-        where = ' where ' + where[:-4]
-    return where, vals
+    for cond, val in kwargs.values():
+        vals += tuple(val) if cond == 'in' else (val,)
+    return vals
+
+
+def _get_where_str(*conds):
+    if not conds:
+        return ''
+    return ' where ' + ' and '.join(key + cond for key, cond in conds)
 
 
 def _get_groups_str(groups: tuple = None):
-    groups_str = ''
-    if groups:
-        groups_str += ' group by '
-        for group in groups:
-            groups_str += group + ','
-    return groups_str[:-1]
+    return ' group by ' + ','.join(groups) if groups else ''
 
 
 def _get_orders_str(orders: tuple = None):
-    orders_str = ''
-    if orders:
-        orders_str += ' order by '
-        for order in orders:
-            orders_str += order + ','
-    return orders_str[:-1]
+    return ' order by ' + ','.join(orders) if orders else ''
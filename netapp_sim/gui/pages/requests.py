@@ -1,12 +1,11 @@
 from datetime import datetime
 from math import floor
 
-from dash import register_page, Input, Output, callback
+from dash import register_page, Input, Output, State, callback, ctx
 from dash.html import Div, Button
+from dash.dcc import Store
 from dash.dash_table import DataTable
 
-from pandas import DataFrame
-
 from model import Request, Attempt
 from protocol import cos_names
 
@@ -32,44 +31,60 @@ for i, col in enumerate(cols):
         cols[i] = col.capitalize()
 cols.extend(['Time (ms)', 'Attempts'])
 
-
-def get_data(page):
-    requests = Request.select_page(page, PAGE_SIZE, orders=('hreq_at',),
-                                   as_obj=False)
+# indexes of the columns formatted by get_data
+ID, COS, DATA, RESULT, STATE, START, FINISH = (
+    cols.index(col)
+    for col in ('ID', 'CoS', 'Data', 'Result', 'State', 'Start', 'Finish'))
+
+
+def get_data(page, cursors: dict):
+    # total number of requests comes as the last field of every row (so it
+    # is only counted separately if the page is empty), from an uncorrelated
+    # subquery run once (count(*) over () would visit every row before
+    # paging, instead of walking the hreq_at index)
+    # a page starts right after the last row of the previous one if it was
+    # seen (cursors keep its start and id by page), instead of skipping the
+    # rows of all previous pages
+    requests = Request.select_page(
+        page, PAGE_SIZE, fields=('*', '(select count(*) from requests)'),
+        orders=('hreq_at', 'id'), as_obj=False,
+        after=cursors.get(str(page - 1)))
+    if requests and requests[-1][START] is not None:
+        cursors[str(page)] = [requests[-1][START], requests[-1][ID]]
+    total = (requests[0][-1] if requests else
+             Request.select(fields=('count(*)',), as_obj=False)[0][0])
+    # attempts of all requests of the page are counted in a single query
+    _attempts = dict(Attempt.select(
+        fields=('req_id', 'count(*)'), groups=('req_id',), as_obj=False,
+        req_id=('in', [row[ID] for row in requests])))
     for row in requests:
-        start = finish = attempts = 0
-        for i, col in enumerate(cols):
-            if col == 'ID':
-                attempts = Attempt.select(fields=('count(*)',), as_obj=False,
-                                          req_id=('=', row[i]))[0][0]
-            elif col == 'CoS':
-                row[i] = cos_names[row[i]]
-            elif col == 'Data' or col == 'Result':
-                row[i] = row[i].decode() if row[i] else None
-            elif col == 'State':
-                row[i] = Request._states[row[i]]
-            elif col == 'Start':
-                start = row[i]
-                row[i] = datetime.fromtimestamp(row[i]) if row[i] else None
-            elif col == 'Finish':
-                finish = row[i]
-                row[i] = datetime.fromtimestamp(row[i]) if row[i] else None
+        del row[-1]
+        start = row[START]
+        finish = row[FINISH]
+        row[COS] = cos_names[row[COS]]
+        row[DATA] = row[DATA].decode() if row[DATA] else None
+        row[RESULT] = row[RESULT].decode() if row[RESULT] else None
+        row[STATE] = Request._states[row[STATE]]
+        row[START] = datetime.fromtimestamp(start) if start else None
+        row[FINISH] = datetime.fromtimestamp(finish) if finish else None
         row.extend([
             round((finish - start) * 1000, 2) if finish else None,
-            attempts
+            _attempts.get(row[ID], 0)
         ])
 
-    _count = Request.select(fields=('count(*)',),
-                            as_obj=False)[0][0] / PAGE_SIZE
+    _count = total / PAGE_SIZE
     count = floor(_count)
 
-    return (DataFrame(requests, columns=cols).to_dict('records'),
-            count + 1 if count < _count else count)
+    # records are built directly (a DataFrame round trip costs more than
+    # formatting the whole page)
+    return ([dict(zip(cols, row)) for row in requests],
+            count + 1 if count < _count else count, cursors)
 
 
 layout = Div(className='page reduced-left', children=[
     Div(className='page-content', children=[
         Button('Refresh', id='refresh-btn', n_clicks=0),
+        Store(id='requests-cursors', data={}),
         DataTable(id='requests-tbl', page_current=0, page_action='custom',
                 page_size=PAGE_SIZE, style_table={'max_width': '100vw'}),
     ])
@@ -80,7 +95,12 @@ layout = Div(className='page reduced-left', children=[
 @callback(
     Output('requests-tbl', 'data'),
     Output('requests-tbl', 'page_count'),
+    Output('requests-cursors', 'data'),
     Input('requests-tbl', 'page_current'),
-    Input('refresh-btn', 'n_clicks'))
-def _update_table(page_current, _):
-    return get_data(page_current + 1)
+    Input('refresh-btn', 'n_clicks'),
+    State('requests-cursors', 'data'))
+def _update_table(page_current, _, cursors):
+    # refreshed data may reorder requests, so known cursors are dropped
+    if ctx.triggered_id == 'refresh-btn':
+        cursors = {}
+    return get_data(page_current + 1, cursors)
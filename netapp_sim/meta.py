@@ -22,6 +22,10 @@ class SingletonMeta(type):
     # possible changes to value of `__init__` argument do not affect returned
     # instance.
     def __call__(cls, *args, **kwargs):
+        # once the Singleton instance exists, it is returned without taking
+        # the lock
+        if cls in cls._instances:
+            return cls._instances[cls]
         # Now, imagine that the program has just been launched. Since there's
         # no Singleton instance yet, multiple threads can simultaneously pass
         # the previous conditional and reach this point almost at the same
@@ -21,13 +21,27 @@
 '''
 
 
-from copy import copy
+from math import inf
 from time import time
+from operator import attrgetter
+from sys import intern
 from datetime import datetime
 
 from consts import HREQ, RREQ, DREQ, DRES, FAIL
 
 
+# dblib imports this module, so it is imported on first use, then kept
+_db = None
+
+
+def _dblib():
+    global _db
+    if _db is None:
+        import dblib
+        _db = dblib
+    return _db
+
+
 class Model:
     '''
         Base class for all model classes.
@@ -40,6 +54,9 @@ class Model:
 
         insert(): Insert as a row in the corresponding database table.
 
+        insert_many(objs): Insert objs as rows in the corresponding database 
+        table.
+
         update(): Update the corresponding database table row.
 
         select(fields, groups, as_obj, **kwargs): Select row(s) from the 
@@ -52,6 +69,26 @@ class Model:
         table.
     '''
 
+    # attributes are slots rather than a per-instance __dict__ (less memory
+    # and faster access when simulating many requests); _all_slots gathers
+    # the slots of the whole class hierarchy, in declaration order (except
+    # _transient ones, which are not part of the object's data), _values
+    # reads them all at once and _keys caches their (prefixed) dict keys
+    __slots__ = ()
+    _all_slots = ()
+    _transient = ()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._all_slots = tuple(slot for klass in reversed(cls.__mro__)
+                               for slot in klass.__dict__.get('__slots__', ())
+                               if slot not in cls._transient)
+        if cls._all_slots:
+            # (extra first slot so that a tuple is returned even for one
+            # slot, zip ignores it)
+            cls._values = attrgetter(*cls._all_slots, cls._all_slots[0])
+        cls._keys = {}
+
     def as_dict(self, flat: bool = False, _prefix: str = ''):
         '''
             Converts object to a dictionary and returns it. If flat is False, 
@@ -63,10 +100,20 @@ class Model:
             (example: cos.id will become cos_id).
         '''
 
+        return dict(self._items(flat, _prefix))
+
+    # (key, value) pairs of as_dict, for subclasses to merge nested objects
+    # into their dicts without building intermediate ones
+    def _items(self, flat: bool, _prefix: str):
         if flat and _prefix:
             _prefix += '_'
-        return {_prefix + str(key): copy(val)
-                for key, val in self.__dict__.items()}
+        keys = self._keys.get(_prefix)
+        if keys is None:
+            keys = self._keys[_prefix] = tuple(
+                _prefix + key for key in self._all_slots)
+        # values are immutable, except nested objects and containers, which
+        # subclasses convert themselves
+        return zip(keys, self._values(self))
 
     # the following methods are for database operations
 
@@ -77,8 +124,19 @@ class Model:
             Returns True if inserted, False if not.
         '''
 
-        from dblib import insert
-        return insert(self)
+        return _dblib().insert(self)
+
+    @classmethod
+    def insert_many(cls, objs: list):
+        '''
+            Insert objs (instances of the class) as rows in the corresponding 
+            database table, their values read straight from their attributes 
+            (no dicts) and packed many rows per statement.
+
+            Returns True if inserted, False if not.
+        '''
+
+        return _dblib().insert_many(cls, objs)
 
     def update(self, _id: tuple = ('id',)):
         '''
@@ -87,8 +145,7 @@ class Model:
             Return True if updated, False if not.
         '''
 
-        from dblib import update
-        return update(self, _id)
+        return _dblib().update(self, _id)
 
     @classmethod
     def select(cls, fields: tuple = ('*',), groups: tuple = None,
@@ -100,24 +157,24 @@ class Model:
 
                 >>> select(CoS, fields=('id', 'name'), id=('=', 1), as_obj=False)
 
-            as_obj should only be set to True if fields is (*).
+            If as_obj is True, fields must be columns of the table (or (*)), 
+            the other columns are not read and left to None (or defaults).
 
             Returns list of rows if selected, None if not.
         '''
 
-        from dblib import select
-        return select(cls, fields, groups, as_obj, **kwargs)
+        return _dblib().select(cls, fields, groups, as_obj, **kwargs)
 
     @classmethod
     def select_page(cls, page: int, page_size: int, fields: tuple = ('*',),
-                    orders: tuple = None, as_obj: bool = True, **kwargs):
+                    orders: tuple = None, as_obj: bool = True,
+                    after: tuple = None, **kwargs):
         '''
             ...
         '''
 
-        from dblib import select_page
-        return select_page(cls, page, page_size, fields, orders, as_obj,
-                           **kwargs)
+        return _dblib().select_page(cls, page, page_size, fields, orders,
+                                    as_obj, after, **kwargs)
 
     @classmethod
     def as_csv(cls, fields: tuple = ('*',), abs_path: str = '', **kwargs):
@@ -131,8 +188,7 @@ class Model:
             Returns True if converted, False if not.
         '''
 
-        from dblib import as_csv
-        return as_csv(cls, fields, abs_path, **kwargs)
+        return _dblib().as_csv(cls, fields, abs_path, **kwargs)
 
     @classmethod
     def columns(cls):
@@ -140,8 +196,7 @@ class Model:
             Returns the list of columns in the corresponding database table.
         '''
 
-        from dblib import _get_columns
-        return _get_columns(cls)
+        return _dblib()._get_columns(cls)
 
 
 class CoSSpecs(Model):
@@ -172,13 +227,18 @@ class CoSSpecs(Model):
         min_disk: Default is 0.
     '''
 
+    __slots__ = ('max_response_time', 'min_concurrent_users',
+                 'min_requests_per_second', 'min_bandwidth', 'max_delay',
+                 'max_jitter', 'max_loss_rate', 'min_cpu', 'min_ram',
+                 'min_disk')
+
     def __init__(self,
-                 max_response_time: float = float('inf'),
+                 max_response_time: float = inf,
                  min_concurrent_users: float = 0,
                  min_requests_per_second: float = 0,
                  min_bandwidth: float = 0,
-                 max_delay: float = float('inf'),
-                 max_jitter: float = float('inf'),
+                 max_delay: float = inf,
+                 max_jitter: float = inf,
                  max_loss_rate: float = 1,
                  min_cpu: int = 0,
                  min_ram: float = 0,
@@ -211,12 +271,30 @@ class CoS(Model):
         specs: CoSSpecs object.
     '''
 
+    __slots__ = ('id', 'name', 'specs', '_dicts')
+    _transient = ('_dicts',)
+
     def __init__(self, id: int, name: str, specs: CoSSpecs = None):
         self.id = id
         self.name = name
-        self.specs = specs if specs else CoSSpecs()
+        self.specs = specs if specs is not None else CoSSpecs()
+        self._dicts = {}
 
     def as_dict(self, flat: bool = False, _prefix: str = ''):
+        d = self._as_dict(flat, _prefix)
+        if not flat:
+            return {**d, 'specs': dict(d['specs'])}
+        return dict(d)
+
+    # a CoS is shared by many requests and rarely changes, so its dicts are
+    # cached (not to be modified), and reused as long as its values (specs
+    # included) are the same, however they were changed
+    def _as_dict(self, flat: bool, _prefix: str):
+        key = (flat, _prefix)
+        values = self._values(self) + self.specs._values(self.specs)
+        cached = self._dicts.get(key)
+        if cached and cached[0] == values:
+            return cached[1]
         d = super().as_dict(flat, _prefix)
         if not flat:
             d['specs'] = self.specs.as_dict()
@@ -224,7 +302,8 @@ class CoS(Model):
             if _prefix:
                 _prefix += '_'
             del d[_prefix + 'specs']
-            d.update(self.specs.as_dict(flat, _prefix=_prefix+'specs'))
+            d.update(self.specs._items(flat, _prefix + 'specs'))
+        self._dicts[key] = (values, d)
         return d
 
     # the following methods serve for access to the CoS specs no matter how
@@ -234,7 +313,7 @@ class CoS(Model):
     def get_max_response_time(self):
         return self.specs.max_response_time
 
-    def set_max_response_time(self, max_response_time: float = float('inf')):
+    def set_max_response_time(self, max_response_time: float = inf):
         self.specs.max_response_time = max_response_time
 
     def get_min_concurrent_users(self):
@@ -258,13 +337,13 @@ class CoS(Model):
     def get_max_delay(self):
         return self.specs.max_delay
 
-    def set_max_delay(self, delay: float = float('inf')):
+    def set_max_delay(self, delay: float = inf):
         self.specs.max_delay = delay
 
     def get_max_jitter(self):
         return self.specs.max_jitter
 
-    def set_max_jitter(self, max_jitter: float = float('inf')):
+    def set_max_jitter(self, max_jitter: float = inf):
         self.specs.max_jitter = max_jitter
 
     def get_max_loss_rate(self):
@@ -326,13 +405,18 @@ class Request(Model):
         new_attempt(): Create new attempt.
     '''
 
-    _states = {
+    __slots__ = ('id', 'cos', 'data', 'result', 'host', 'state', 'hreq_at',
+                 'dres_at', 'attempts', '_attempt_no', '_late')
+    _transient = ('_late',)
+
+    # state descriptions, indexed by state (states are small ints, up to DRES)
+    _states = tuple({
         HREQ: 'waiting for host',
         RREQ: 'waiting for resources',
         DREQ: 'waiting for data',
         DRES: 'finished',
         FAIL: 'failed'
-    }
+    }.get(state) for state in range(DRES + 1))
 
     def __init__(self, id, cos: CoS, data: bytes, result: bytes = None,
                  host: str = None, state: int = None, hreq_at: float = None,
@@ -341,18 +425,18 @@ class Request(Model):
         self.cos = cos
         self.data = data
         self.result = result
-        self.host = host
+        self.host = intern(host) if type(host) is str else host
         self.state = state
         self.hreq_at = hreq_at
         self.dres_at = dres_at
-        if not attempts:
+        if attempts is None:
             attempts = {}
         self.attempts = attempts
         self._attempt_no = 0
         self._late = False
 
     def _t(self, x):
-        return datetime.fromtimestamp(x) if x != None else x
+        return datetime.fromtimestamp(x) if x is not None else x
 
     def __repr__(self):
         return ('\nrequest(id=%s, state=(%s), cos=%s, host=%s, hreq_at=%s, '
@@ -362,18 +446,16 @@ class Request(Model):
 
     def as_dict(self, flat: bool = False):
         d = super().as_dict(flat)
-        del d['_late']
         if not flat:
             d['cos'] = self.cos.as_dict()
-            for attempt_no, attempt in self.attempts.items():
-                d['attempts'][attempt_no] = attempt.as_dict()
+            d['attempts'] = {attempt_no: attempt.as_dict()
+                             for attempt_no, attempt in self.attempts.items()}
         else:
             del d['cos']
-            d.update(self.cos.as_dict(flat, _prefix='cos'))
+            d.update(self.cos._as_dict(flat, 'cos'))
             del d['attempts']
             for attempt_no, attempt in self.attempts.items():
-                d.update(attempt.as_dict(flat,
-                                         _prefix='attempts_'+str(attempt_no)))
+                d.update(attempt._items(flat, 'attempts_' + str(attempt_no)))
         return d
 
     def new_attempt(self):
@@ -448,13 +530,16 @@ class Attempt(Model):
         dres_at: Data exchange response timestamp (end of operation).
     '''
 
+    __slots__ = ('req_id', 'attempt_no', 'host', 'state', 'hreq_at', 'hres_at',
+                 'rres_at', 'dres_at')
+
     def __init__(self, req_id, attempt_no: int, host: str = None,
                  state: int = None, hreq_at: float = None,
                  hres_at: float = None, rres_at: float = None,
                  dres_at: float = None):
         self.req_id = req_id
         self.attempt_no = attempt_no
-        self.host = host
+        self.host = intern(host) if type(host) is str else host
         self.state = state
         self.hreq_at = hreq_at
         self.hres_at = hres_at
@@ -483,15 +568,18 @@ class Response(Model):
         timestamp: Response timestamp.
     '''
 
+    __slots__ = ('req_id', 'attempt_no', 'host', 'cpu', 'ram', 'disk',
+                 'timestamp')
+
     def __init__(self, req_id, attempt_no: int, host: str, cpu: int = None,
                  ram: float = None, disk: float = None,
-                 timestamp: float = 0):
+                 timestamp: float = None):
         self.req_id = req_id
         self.attempt_no = attempt_no
-        self.host = host
+        self.host = intern(host) if type(host) is str else host
         self.cpu = cpu
         self.ram = ram
         self.disk = disk
-        if not timestamp:
+        if timestamp is None:
             timestamp = time()
         self.timestamp = timestamp
@@ -1,4 +1,4 @@
-from threading import Thread
+from threading import Thread, Event
 from time import monotonic, sleep
 from psutil import net_if_addrs, net_if_stats, net_io_counters
 from psutil import cpu_count, virtual_memory, disk_usage
@@ -7,6 +7,15 @@ from socket import socket, AF_INET, SOCK_STREAM
 from meta import SingletonMeta
 
 
+# network interfaces stats (speeds) hardly change, so they are only read
+# again after this period (in s), or when an interface is missing from them
+_STATS_PERIOD = 30
+
+# interfaces missing from the IP addresses cache are only looked up again
+# after this period (in s)
+_IPS_PERIOD = 30
+
+
 class Monitor(metaclass=SingletonMeta):
     '''
         Class for monitoring the state of resources of the node it's running on 
@@ -62,26 +71,27 @@ class Monitor(metaclass=SingletonMeta):
         self.ping_timeout = ping_timeout
 
         self._ips = {}
-        for _iface, _addrs in net_if_addrs().items():
-            for _addr in _addrs:
-                if _addr.family == AF_INET:
-                    self._ips[_iface] = _addr.address
+        self._ips_at = None
+        self._get_ips()
 
-        self._run = False
+        # set when stopped, so the monitoring thread wakes up from its wait
+        # as soon as it is stopped
+        self._stopped = Event()
+        self._stopped.set()
 
     def start(self):
         '''
             Start monitoring thread.
         '''
-        if not self._run:
-            self._run = True
+        if self._stopped.is_set():
+            self._stopped.clear()
             Thread(target=self._start).start()
 
     def stop(self):
         '''
             Stop monitoring thread.
         '''
-        self._run = False
+        self._stopped.set()
 
     def set_monitor_period(self, period: float = 1):
         self.monitor_period = period
@@ -97,9 +107,15 @@ class Monitor(metaclass=SingletonMeta):
         # get network I/O stats on each interface
         # by setting pernic to True
         io = net_io_counters(pernic=True)
-        while self._run:
-            # node specs
-            self.measures['cpu_count'] = cpu_count()
+        stats = net_if_stats()
+        stats_at = monotonic()
+        # node specs
+        # (the number of CPUs does not change, totals are read with free
+        # sizes anyway)
+        self.measures['cpu_count'] = cpu_count()
+        while not self._stopped.is_set():
+            # (period read once, in case it is changed while sleeping)
+            period = self.monitor_period
             mem = virtual_memory()
             self.measures['memory_total'] = mem.total / 1e+6  # in MB
             self.measures['memory_free'] = mem.available / 1e+6  # in MB
@@ -115,10 +131,14 @@ class Monitor(metaclass=SingletonMeta):
                     Thread(target=self._get_delay, args=(iface,)).start()
             '''
             # get network I/O stats on each interface again
-            sleep(self.monitor_period)
+            if self._stopped.wait(period):
+                break
             io_2 = net_io_counters(pernic=True)
             # get network interfaces stats
-            stats = net_if_stats()
+            if (monotonic() - stats_at >= _STATS_PERIOD
+                    or not io_2.keys() <= stats.keys()):
+                stats = net_if_stats()
+                stats_at = monotonic()
             for iface in io:
                 if iface != 'lo' and iface in io_2 and iface in stats:
                     # bandwidth
@@ -127,9 +147,9 @@ class Monitor(metaclass=SingletonMeta):
                     prev = io[iface]
                     next = io_2[iface]
                     up_bytes = next.bytes_sent - prev.bytes_sent
-                    up_speed = up_bytes * 8 / self.monitor_period  # in bits/s
+                    up_speed = up_bytes * 8 / period  # in bits/s
                     down_bytes = next.bytes_recv - prev.bytes_recv
-                    down_speed = down_bytes * 8 / self.monitor_period  # in bits/s
+                    down_speed = down_bytes * 8 / period  # in bits/s
                     #  get max speed (capacity)
                     max_speed = stats[iface].speed * 1000000  # in bits/s
                     # calculate free bandwidth
@@ -137,11 +157,13 @@ class Monitor(metaclass=SingletonMeta):
                     bandwidth_down = (max_speed - down_speed) / \
                         1e+6  # in Mbits/s
                     #  save bandwidth measurement
-                    self.measures.setdefault(iface, {})
-                    self.measures[iface]['bandwidth_up'] = bandwidth_up
-                    self.measures[iface]['bandwidth_down'] = bandwidth_down
-                    self.measures[iface]['tx_packets'] = next.packets_sent
-                    self.measures[iface]['rx_packets'] = next.packets_recv
+                    # (setdefault is atomic, so this loop and delay probes
+                    # always share one dict per interface)
+                    iface_measures = self.measures.setdefault(iface, {})
+                    iface_measures['bandwidth_up'] = bandwidth_up
+                    iface_measures['bandwidth_down'] = bandwidth_down
+                    iface_measures['tx_packets'] = next.packets_sent
+                    iface_measures['rx_packets'] = next.packets_recv
                 # if interface is removed during monitor period
                 # remove from measures dict
                 elif iface not in io_2 or iface not in stats:
@@ -178,23 +200,28 @@ class Monitor(metaclass=SingletonMeta):
             finally:
                 # close connection
                 s.close()
-                self.measures.setdefault(via_iface, {})
-                self.measures[via_iface]['delay'] = delay
+                # (in one step, the monitoring thread could remove the
+                # interface from measures between two)
+                self.measures.setdefault(via_iface, {})['delay'] = delay
 
     def _get_ip(self, iface: str):
         '''
             Returns IP address of interface specified by name.
         '''
-        if iface in self._ips:
-            return self._ips[iface]
-        else:
-            addrs = net_if_addrs()
-            if iface in addrs:
-                for addr in addrs[iface]:
-                    if addr.family == AF_INET:
-                        self._ips[iface] = addr.address
-                        return addr.address
-            return None
+        if iface not in self._ips and (
+                monotonic() - self._ips_at >= _IPS_PERIOD):
+            self._get_ips()
+        return self._ips.get(iface)
+
+    def _get_ips(self):
+        '''
+            Reads the IP addresses of all interfaces into the cache.
+        '''
+        for iface, addrs in net_if_addrs().items():
+            for addr in addrs:
+                if addr.family == AF_INET:
+                    self._ips[iface] = addr.address
+        self._ips_at = monotonic()
 
 
 # for testing
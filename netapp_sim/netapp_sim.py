@@ -4,6 +4,7 @@
 '''
 
 
+import sys
 from threading import Thread
 from logging import getLogger
 from flask import cli
@@ -40,6 +41,9 @@ if __name__ == '__main__':
     app.logger.disabled = True
     Thread(target=app.run, args=('0.0.0.0',)).start()
     print('\nServer starting at http://' + MY_IP + ':8050')
+    # free-threaded builds (Python 3.13+) can run threads in parallel
+    if not getattr(sys, '_is_gil_enabled', lambda: True)():
+        print('\nRunning without GIL (free-threaded build)')
     # starting cli
     print('\nChoose a Class of Service and click ENTER to send a request\n'
           'Or wait to receive requests')
@@ -20,11 +20,12 @@
 
 
 from os import getenv
-from threading import Thread
+from threading import Thread, Lock
 from time import time
-from string import ascii_letters, digits
-from random import choice
+from secrets import token_urlsafe
+from itertools import chain
 from logging import info, basicConfig, INFO, root
+from socket import socket, AF_INET, SOCK_RAW, IPPROTO_RAW
 
 from scapy.all import (Packet, ByteEnumField, StrLenField, IntEnumField,
                        StrField, IntField, IEEEDoubleField, ConditionalField,
@@ -34,6 +35,7 @@ from scapy.all import (Packet, ByteEnumField, StrLenField, IntEnumField,
 from simulator import (get_resources, check_resources, reserve_resources, 
                        free_resources, execute)
 from model import CoS, Request, Attempt, Response
+from dblib import insert_all
 from consts import *
 import config
 
@@ -65,6 +67,10 @@ requests = {'_': None}  # '_' is placeholder
 requests.update(
     {req[0]: None for req in Request.select(fields=('id',), as_obj=False)})
 
+# to generate and register request IDs atomically (send_request can be
+# called from many threads, which run in parallel on free-threaded builds)
+_requests_lock = Lock()
+
 # dict of requests received by provider (keys are (src IP, request ID))
 _requests = {}
 
@@ -73,6 +79,9 @@ _responses = {}
 
 
 class _Request(Request):
+    __slots__ = ('_thread', '_freed')
+    _transient = Request._transient + __slots__
+
     def __init__(self, id):
         super().__init__(id, None, None)
         self._thread = None
@@ -194,6 +203,29 @@ conf.checkIPaddr = False
 conf.checkIPsrc = False
 # making them false means IP src must be checked manually
 
+# broadcast host request packet, copied for each attempt instead of building
+# its layers every time
+_hreq_template = (Ether(dst=BROADCAST_MAC)
+                  / IP(dst=BROADCAST_IP)
+                  / MyProtocol(state=HREQ))
+
+# raw IP socket kept open for packets that expect no answer (scapy's send
+# opens and closes a socket for each packet)
+try:
+    _raw_socket = socket(AF_INET, SOCK_RAW, IPPROTO_RAW)
+except OSError:
+    _raw_socket = None
+
+
+def _send(pkt, **kwargs):
+    if _raw_socket:
+        try:
+            _raw_socket.sendto(bytes(pkt), (pkt[IP].dst, 0))
+            return
+        except OSError:
+            pass
+    send(pkt, verbose=0)
+
 
 class MyProtocolAM(AnsweringMachine):
     '''
@@ -204,7 +236,7 @@ class MyProtocolAM(AnsweringMachine):
 
     function_name = 'mpam'
     sniff_options = {'filter': 'inbound'}
-    send_function = staticmethod(send)
+    send_function = staticmethod(_send)
 
     def is_request(self, req):
         # a packet must have Ether, IP and MyProtocol layers
@@ -414,7 +446,7 @@ class MyProtocolAM(AnsweringMachine):
             free_resources(_requests[_req_id])
             _requests[_req_id].state = HREQ
             my_proto.state = RCAN
-            send(IP(dst=ip_src) / my_proto, verbose=0)
+            _send(IP(dst=ip_src) / my_proto)
 
     def _respond_data(self, my_proto, ip_src):
         info('Executing')
@@ -453,12 +485,16 @@ class MyProtocolAM(AnsweringMachine):
 MyProtocolAM(verbose=0)(bg=True)
 
 
-def _generate_request_id():
-    id = '_'
-    while id in requests:
-        id = ''.join(
-            choice(ascii_letters + digits) for _ in range(REQ_ID_LEN))
-    return id
+# generate a new request ID and register the request under it, atomically
+def _register_request(cos_id: int, data: bytes):
+    with _requests_lock:
+        id = '_'
+        while id in requests:
+            # random url-safe characters (letters, digits, - and _), 6 bits
+            # each
+            id = token_urlsafe(REQ_ID_LEN)[:REQ_ID_LEN]
+        req = requests[id] = Request(id, cos_dict[cos_id], data)
+    return req
 
 
 def send_request(cos_id: int, data: bytes):
@@ -467,9 +503,8 @@ def send_request(cos_id: int, data: bytes):
         identified by cos_id, with data as input.
     '''
 
-    req_id = _generate_request_id()
-    req = Request(req_id, cos_dict[cos_id], data)
-    requests[req_id] = req
+    req = _register_request(cos_id, data)
+    req_id = req.id
 
     hreq_rt = PROTO_RETRIES
     hres = None
@@ -488,11 +523,11 @@ def send_request(cos_id: int, data: bytes):
         info(req)
         hreq_rt -= 1
         # send broadcast and wait for first response
-        hres = srp1(Ether(dst=BROADCAST_MAC)
-                    / IP(dst=BROADCAST_IP)
-                    / MyProtocol(state=HREQ, req_id=req_id, cos_id=req.cos.id,
-                                 attempt_no=attempt.attempt_no),
-                    timeout=PROTO_TIMEOUT, verbose=0)
+        hreq = _hreq_template.copy()
+        hreq[MyProtocol].req_id = req_id
+        hreq[MyProtocol].cos_id = req.cos.id
+        hreq[MyProtocol].attempt_no = attempt.attempt_no
+        hres = srp1(hreq, timeout=PROTO_TIMEOUT, verbose=0)
         if hres and not req.dres_at:
             attempt.hres_at = time()
             attempt.state = RREQ
@@ -605,9 +640,8 @@ def send_request(cos_id: int, data: bytes):
                                 info(
                                     'Send data exchange acknowledgement to %s' % req.host)
                                 info(req)
-                                send(IP(dst=req.host)
-                                     / MyProtocol(state=DACK, req_id=req_id),
-                                     verbose=0)
+                                _send(IP(dst=req.host)
+                                      / MyProtocol(state=DACK, req_id=req_id))
                             Thread(target=_save, args=(req,)).start()
                             return req.result
                         elif not req.dres_at:
@@ -631,19 +665,26 @@ def send_request(cos_id: int, data: bytes):
         return req.result
 
 
+# CSV files are rewritten from the whole tables, so saves that finish while a
+# rewrite is waiting to start leave their rows to it instead of queuing their
+# own (one rewrite at a time, at most one waiting)
+_csv_lock = Lock()
+_csv_waiting = Lock()
+
+
 def _save(req: Request):
-    req.insert()
-    for attempt in req.attempts.values():
-        attempt.insert()
-    if req.id in _responses:
-        for response in _responses[req.id]:
-            response.insert()
-
-    # if simulation is active (like mininet), create different CSV files for
-    # different hosts (add IP address to file name)
-    _suffix = ''
-    if getenv('SIMULATION_ACTIVE', False) == 'True':
-        _suffix = '.' + MY_IP
-    Request.as_csv(_suffix=_suffix)
-    Attempt.as_csv(_suffix=_suffix)
-    Response.as_csv(_suffix=_suffix)
+    insert_all(chain((req,), req.attempts.values(),
+                     _responses.get(req.id, ())))
+
+    if not _csv_waiting.acquire(blocking=False):
+        return
+    with _csv_lock:
+        _csv_waiting.release()
+        # if simulation is active (like mininet), create different CSV files
+        # for different hosts (add IP address to file name)
+        _suffix = ''
+        if getenv('SIMULATION_ACTIVE', False) == 'True':
+            _suffix = '.' + MY_IP
+        Request.as_csv(_suffix=_suffix)
+        Attempt.as_csv(_suffix=_suffix)
+        Response.as_csv(_suffix=_suffix)
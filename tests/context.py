@@ -3,3 +3,6 @@ from os.path import dirname, abspath, join
 
 
 path.insert(0, abspath(join(dirname(__file__), '..')))
+
+
+import netapp_sim  # puts its modules (importing each other) on path
@@ -0,0 +1,153 @@
+from sqlite3 import IntegrityError
+
+from pytest import fixture, raises
+
+from .context import netapp_sim  # (puts its modules on path)
+import dblib
+from model import CoS, CoSSpecs, Request, Attempt, Response
+
+
+@fixture(scope='module', autouse=True)
+def database(tmp_path_factory):
+    # tests run on a new database file instead of the one of conf.yml (set
+    # before the first connection is made)
+    dblib.DB_PATH = str(tmp_path_factory.mktemp('data') / 'test.db')
+
+
+@fixture
+def cos():
+    return CoS.select(id=('=', 1))[0]
+
+
+def _ids(rows):
+    return [row[0] for row in rows]
+
+
+def test_insert(cos):
+    assert Request('insert', cos, b'data', state=1, hreq_at=1.0).insert()
+    req = Request.select(id=('=', 'insert'))[0]
+    assert (req.data, req.state, req.hreq_at) == (b'data', 1, 1.0)
+    assert req.cos.name == cos.name
+
+
+def test_insert_duplicate(cos):
+    assert Request('duplicate', cos, b'first').insert()
+    assert not Request('duplicate', cos, b'second').insert()
+    assert Request.select(fields=('data',), as_obj=False,
+                          id=('=', 'duplicate')) == [[b'first']]
+
+
+def test_insert_many(cos):
+    # one full batch of rows, and the remaining ones row by row
+    count = dblib._batch_rows[Attempt] + 10
+    assert Request('many', cos, b'').insert()
+    assert Attempt.insert_many(
+        [Attempt('many', i, 'host', 1) for i in range(count)])
+    assert sorted(attempt.attempt_no for attempt in Attempt.select(
+        req_id=('=', 'many'))) == list(range(count))
+    assert len(Request.select(id=('=', 'many'))[0].attempts) == count
+
+
+def test_insert_many_duplicate_in_tail(cos):
+    count = dblib._batch_rows[Request] + 2
+    reqs = [Request('tail-%d' % i, cos, b'') for i in range(count)]
+    assert not Request.insert_many(reqs + [reqs[-1]])
+    # rows other than the duplicate are still inserted
+    assert len(Request.select(id=('in', [req.id for req in reqs]))) == count
+
+
+def test_insert_all(cos):
+    count = dblib._batch_rows[Response] + 3
+    objs = [Request('all', cos, b'')] + [Attempt('all', 1, 'host')] + [
+        Response('all', 1, 'host-%d' % i, 1, 1.0, 1.0) for i in range(count)]
+    assert dblib.insert_all(objs)
+    assert len(Response.select(req_id=('=', 'all'))) == count
+    assert Request.select(id=('=', 'all'))[0].attempts[1].host == 'host'
+
+
+def test_transaction(cos):
+    with dblib.transaction():
+        Request('txn-1', cos, b'').insert()
+        with dblib.transaction():
+            Request('txn-2', cos, b'').insert()
+    assert _ids(Request.select(fields=('id',), as_obj=False,
+                               id=('in', ('txn-1', 'txn-2')))) == [
+        'txn-1', 'txn-2']
+
+
+def test_transaction_rollback(cos):
+    assert Request('rollback', cos, b'').insert()
+    with raises(IntegrityError):
+        with dblib.transaction():
+            Request('rollback-1', cos, b'').insert()
+            Request('rollback', cos, b'').insert()
+    with raises(ValueError):
+        with dblib.transaction():
+            Request('rollback-2', cos, b'').insert()
+            raise ValueError
+    assert Request.select(id=('in', ('rollback-1', 'rollback-2'))) == []
+
+
+def test_select_page_after(cos):
+    # same hreq_at for some rows, so pages also go by id
+    reqs = [Request('page-%02d' % i, cos, b'', hreq_at=100 + i // 3)
+            for i in range(10)]
+    assert Request.insert_many(reqs)
+    orders = ('hreq_at', 'id')
+    conds = {'hreq_at': ('>=', 100)}
+    pages = []
+    after = None
+    while True:
+        page = Request.select_page(1, 4, fields=orders, orders=orders,
+                                   as_obj=False, after=after, **conds)
+        if not page:
+            break
+        pages.append(page)
+        after = page[-1]
+    # same pages as by offset
+    assert pages == [Request.select_page(
+        i, 4, fields=orders, orders=orders, as_obj=False, **conds)
+        for i in (1, 2, 3)]
+    assert [row[1] for page in pages for row in page] == [
+        req.id for req in reqs]
+
+
+def test_cos_update_invalidates_cache():
+    cos = CoS(100, 'cached', CoSSpecs(min_cpu=1))
+    assert cos.insert()
+    assert Request('cached', cos, b'').insert()
+    assert Request.select(id=('=', 'cached'))[0].cos.name == 'cached'
+    cos.name = 'updated'
+    assert cos.update()
+    assert Request.select(id=('=', 'cached'))[0].cos.name == 'updated'
+    with dblib.transaction():
+        cos.name = 'updated-in-transaction'
+        cos.update()
+    assert Request.select(id=('=', 'cached'))[0].cos.name == (
+        'updated-in-transaction')
+
+
+def test_select_projection(cos):
+    assert Request('projection', cos, b'data', state=1, hreq_at=1.0).insert()
+    assert Attempt('projection', 1, 'host').insert()
+    req = Request.select(fields=('id', 'state'), id=('=', 'projection'))[0]
+    # fields not requested are not read, the CoS and attempts still are
+    assert (req.id, req.state, req.data, req.hreq_at) == (
+        'projection', 1, None, None)
+    assert req.cos.name == cos.name
+    assert req.get_min_cpu() == cos.get_min_cpu()
+    assert list(req.attempts) == [1]
+    assert 'projection' in repr(req)
+    assert req.as_dict(flat=True)['cos_name'] == cos.name
+    attempt = Attempt.select(fields=('host',), req_id=('=', 'projection'))[0]
+    assert (attempt.req_id, attempt.attempt_no, attempt.host) == (
+        'projection', 1, 'host')
+
+
+def test_select_projection_timestamp(cos):
+    assert Request('timestamp', cos, b'').insert()
+    assert Response('timestamp', 1, 'host', 1, 1.0, 1.0, 10.0).insert()
+    res = Response.select(fields=('req_id', 'host'),
+                          req_id=('=', 'timestamp'))[0]
+    # the stored timestamp, not the time the object was built
+    assert (res.host, res.cpu, res.timestamp) == ('host', None, 10.0)